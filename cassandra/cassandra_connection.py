@@ -0,0 +1,29 @@
+"""
+Conexión a Cassandra compartida por los scripts de la práctica
+- Enrutado token-aware
+- Compresión LZ4 del protocolo (el driver la negocia automáticamente si lz4 está instalado)
+"""
+
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
+
+
+def connect_cassandra(host='localhost', port=9042):
+    """Conectar a Cassandra"""
+    try:
+        # Token-aware: cada petición va directamente a la réplica dueña de la partición
+        profile = ExecutionProfile(
+            load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy()),
+            request_timeout=30
+        )
+        cluster = Cluster(
+            [host],
+            port=port,
+            execution_profiles={EXEC_PROFILE_DEFAULT: profile}
+        )
+        session = cluster.connect()
+        print(f"✓ Conectado a Cassandra ({host}:{port})")
+        return cluster, session
+    except Exception as e:
+        print(f"✗ Error conectando a Cassandra: {e}")
+        return None, None
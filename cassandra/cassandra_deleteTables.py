@@ -1,17 +1,6 @@
-from cassandra.cluster import Cluster
+from cassandra_connection import connect_cassandra
 
 
-def connect_cassandra(host='localhost', port=9042):
-    """Conectar a Cassandra"""
-    try:
-        cluster = Cluster([host], port=port)
-        session = cluster.connect()
-        print(f"✓ Conectado a Cassandra ({host}:{port})")
-        return cluster, session
-    except Exception as e:
-        print(f"✗ Error conectando a Cassandra: {e}")
-        return None, None
-    
 def drop_all_tables(session,cluster):
     """borrar todas las tablas del keyspace techstore"""
     
@@ -21,14 +10,16 @@ def drop_all_tables(session,cluster):
         'events_by_day',
         'products_by_category',
         'requests_by_time',
-        'user_sessions'
+        'user_sessions',
+        'events_count_by_type'
     ]
     
-    # Borrar cada tabla
+    # Lanzar todos los DROP a la vez y esperar después a cada uno
     print("Borrando tablas...\n")
-    for table in tables:
+    futures = [session.execute_async(f"DROP TABLE IF EXISTS {table}") for table in tables]
+    for table, future in zip(tables, futures):
         try:
-            session.execute(f"DROP TABLE IF EXISTS {table}")
+            future.result()
             print(f"  ✓ Tabla '{table}' borrada")
         except Exception as e:
             print(f"  ✗ Error borrando '{table}': {e}")
@@ -43,7 +34,7 @@ def drop_all_tables(session,cluster):
 
 if __name__ == "__main__":
     cluster,session = connect_cassandra()
-    session.set_keyspace("techstore")
     if session != None:
+        session.set_keyspace("techstore")
         drop_all_tables(session,cluster)
     print("Todas las tablas de Cassandra borradas con éxito")
\ No newline at end of file
@@ -4,24 +4,28 @@ Script para Cassandra - Almacenamiento histórico
 - Consultas de lectura
 """
 
-from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
 from datetime import datetime
 import time
+import sys
 import os
 
+from cassandra_connection import connect_cassandra
+
 # Datos
 EVENT_TYPES = ['page_view', 'product_view', 'add_to_cart', 'search']
+CATEGORIES = ('Tablets', 'Laptops', 'Audio')
+
+
+def _fmt(t):
+    """Formatear un datetime como '%Y-%m-%d %H:%M:%S' sin pasar por strftime"""
+    return f"{t.year:04d}-{t.month:02d}-{t.day:02d} {t.hour:02d}:{t.minute:02d}:{t.second:02d}"
 
-def connect_cassandra(host='localhost', port=9042):
-    """Conectar a Cassandra"""
-    try:
-        cluster = Cluster([host], port=port)
-        session = cluster.connect()
-        print(f"✓ Conectado a Cassandra ({host}:{port})")
-        return cluster, session
-    except Exception as e:
-        print(f"✗ Error conectando a Cassandra: {e}")
-        return None, None
+
+def write_lines(lines):
+    """Escribir todas las filas de un resultado de golpe en lugar de un print por fila"""
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
 
 
 def run_queries(session):
@@ -30,48 +34,60 @@ def run_queries(session):
     print("CONSULTAS DE LECTURA")
     print("="*60)
 
+    # Preparar cada plantilla una sola vez: el coordinador no vuelve a parsearla en cada ejecución.
+    # Solo se piden las columnas que se muestran
+    q_today = session.prepare(
+        "SELECT event_time, event_type, session_id FROM events_by_day WHERE event_date = ? AND event_hour = ? LIMIT 10"
+    )
+    q_top = session.prepare(
+        "SELECT product_name, views FROM products_by_category WHERE category = ? LIMIT 3"
+    )
+    q_session = session.prepare(
+        "SELECT total_events, start_time, end_time FROM user_sessions WHERE session_id = ?"
+    )
+    q_evt = session.prepare(
+        "SELECT event_type, cnt FROM events_count_by_type"
+    )
+
     # Consulta 1: Eventos de hoy
     hour = 9
     print(f"\n1. Últimos 10 eventos de hoy a las {hour}:00:")
     today = datetime.now().date()
-    rows = session.execute(
-        "SELECT * FROM events_by_day WHERE event_date = %s  AND event_hour = %s LIMIT 10",
-        [today,hour]
-    )
-    for row in rows:
-        print(f"\t {row.event_time.strftime("%Y-%m-%d %H:%M:%S")} -> {row.event_type} en sesión {row.session_id}")
+    rows = session.execute(q_today, [today, hour])
+    write_lines([
+        f"\t {_fmt(row.event_time)} -> {row.event_type} en sesión {row.session_id}"
+        for row in rows
+    ])
 
 
     # Consulta 2: Top N por categoría
     print("\n2. Top productos por categoría:")
-    for category in ['Tablets', 'Laptops', 'Audio']: 
-        rows = session.execute(
-            "SELECT product_name, views FROM products_by_category WHERE category = %s LIMIT 3",
-            [category]
-        )
-        print(f"   {category} (Top 3):")
-        for row in rows:
-            print(f"\t{row.product_name} -> {row.views} vistas")
+    # Las 3 categorías se consultan a la vez
+    results = execute_concurrent_with_args(
+        session, q_top, [(category,) for category in CATEGORIES],
+        concurrency=len(CATEGORIES), raise_on_first_error=False
+    )
+    for category, (success, rows) in zip(CATEGORIES, results):
+        if not success:
+            write_lines([f"   ✗ Error consultando {category}: {rows}"])
+            continue
+        write_lines([f"   {category} (Top 3):"] + [
+            f"\t{row.product_name} -> {row.views} vistas" for row in rows
+        ])
 
     # Consulta 3: Sesiones específicas
     print("\n3. Sesiones específicas de usuario:")
-    rows = session.execute(
-        "SELECT * FROM user_sessions WHERE session_id=%s",
-        ['session_1']
-    ) 
-    for row in rows:
-        print(f"\t {row.total_events} eventos en una sesión desde las {row.start_time.strftime("%Y-%m-%d %H:%M:%S")} hasta las {row.end_time.strftime("%Y-%m-%d %H:%M:%S")}")
+    rows = session.execute(q_session, ['session_1'])
+    write_lines([
+        f"\t {row.total_events} eventos en una sesión desde las {_fmt(row.start_time)} hasta las {_fmt(row.end_time)}"
+        for row in rows
+    ])
 
     # Consulta 5: Eventos por tipo
     print("\n6. Distribución de eventos por tipo:")
-    
-    for event_type in EVENT_TYPES:
-        rows = session.execute(
-            "SELECT COUNT(*) as count FROM events_by_day WHERE event_type = %s ALLOW FILTERING",
-            [event_type]
-        )
-        for row in rows:
-            print(f"\t Registrados {row.count} de {event_type}'s")
+    # Contadores mantenidos al insertar: una lectura de 4 filas en lugar de 4 escaneos completos
+    counts = {row.event_type: row.cnt for row in session.execute(q_evt)}
+    write_lines([f"\t Registrados {counts.get(event_type, 0)} de {event_type}'s" for event_type in EVENT_TYPES])
 
 
 
@@ -4,52 +4,56 @@ Script para Cassandra - Almacenamiento histórico
 - Consultas de lectura
 """
 
-from cassandra.cluster import Cluster
-from datetime import datetime, timedelta
-import random
+from cassandra.concurrent import execute_concurrent, execute_concurrent_with_args
+from cassandra.query import BatchStatement, BatchType
+from datetime import datetime
+from itertools import groupby
 import time
 import os
 
-# Datos de productos
-PRODUCTS = [
+import numpy as np
+
+from cassandra_connection import connect_cassandra
+
+# Datos de productos: (category, id, name)
+PRODUCTS = (
     # Smartphones 
-    {"id": 1, "name": "Smartphone Pro X", "category": "Smartphones"},
-    {"id": 6, "name": "Smartphone Max 14", "category": "Smartphones"},
-    {"id": 7, "name": "Smartphone Lite 5G", "category": "Smartphones"},
+    ("Smartphones", 1, "Smartphone Pro X"),
+    ("Smartphones", 6, "Smartphone Max 14"),
+    ("Smartphones", 7, "Smartphone Lite 5G"),
     
     # Laptops 
-    {"id": 2, "name": "Laptop Ultra 15", "category": "Laptops"},
-    {"id": 8, "name": "Laptop Gaming 17", "category": "Laptops"},
-    {"id": 9, "name": "Laptop Business 13", "category": "Laptops"},
+    ("Laptops", 2, "Laptop Ultra 15"),
+    ("Laptops", 8, "Laptop Gaming 17"),
+    ("Laptops", 9, "Laptop Business 13"),
     
     # Audio 
-    {"id": 3, "name": "Auriculares BT Pro", "category": "Audio"},
-    {"id": 10, "name": "Auriculares Noise Cancel", "category": "Audio"},
-    {"id": 11, "name": "Altavoz Portátil 360", "category": "Audio"},
+    ("Audio", 3, "Auriculares BT Pro"),
+    ("Audio", 10, "Auriculares Noise Cancel"),
+    ("Audio", 11, "Altavoz Portátil 360"),
     
     # Wearables 
-    {"id": 4, "name": "Smartwatch Fit", "category": "Wearables"},
-    {"id": 12, "name": "Smartwatch Sport GPS", "category": "Wearables"},
-    {"id": 13, "name": "Pulsera Actividad Pro", "category": "Wearables"},
+    ("Wearables", 4, "Smartwatch Fit"),
+    ("Wearables", 12, "Smartwatch Sport GPS"),
+    ("Wearables", 13, "Pulsera Actividad Pro"),
     
     # Tablets 
-    {"id": 5, "name": "Tablet Pro 12", "category": "Tablets"},
-    {"id": 14, "name": "Tablet Air 10", "category": "Tablets"},
-    {"id": 15, "name": "Tablet Kids Edition", "category": "Tablets"},
-]
+    ("Tablets", 5, "Tablet Pro 12"),
+    ("Tablets", 14, "Tablet Air 10"),
+    ("Tablets", 15, "Tablet Kids Edition"),
+)
 
-EVENT_TYPES = ['page_view', 'product_view', 'add_to_cart', 'search']
+PRODUCT_IDS = tuple(p[1] for p in PRODUCTS)
 
-def connect_cassandra(host='localhost', port=9042):
-    """Conectar a Cassandra"""
-    try:
-        cluster = Cluster([host], port=port)
-        session = cluster.connect()
-        print(f"✓ Conectado a Cassandra ({host}:{port})")
-        return cluster, session
-    except Exception as e:
-        print(f"✗ Error conectando a Cassandra: {e}")
-        return None, None
+EVENT_TYPES = ('page_view', 'product_view', 'add_to_cart', 'search')
+
+# Mensajes de progreso durante la generación (VERBOSE=1)
+VERBOSE = os.getenv("VERBOSE", "0") == "1"
+
+# Número de inserciones en vuelo simultáneamente
+CONCURRENCY = 100
+# Máximo de filas por batch (por debajo del umbral de aviso de Cassandra)
+BATCH_SIZE = 50
 
 def create_keyspace(session):
     """Crear keyspace"""
@@ -113,11 +117,57 @@ def create_tables(session):
             ) WITH CLUSTERING ORDER BY (total_events DESC)
         """)
 
+        # Tabla 5: Contador de eventos por tipo (evita COUNT(*) con ALLOW FILTERING)
+        session.execute("""
+            CREATE TABLE IF NOT EXISTS events_count_by_type (
+                event_type text PRIMARY KEY,
+                cnt counter
+            )
+        """)
+
         print("✓ Tablas creadas")
     except Exception as e:
         print(f"Error creando tablas: {e}")
 
 
+def insert_concurrent(session, statement, args_list):
+    """
+    Ejecutar un prepared statement para cada tupla de args con varias peticiones en vuelo.
+    Devuelve una lista con el éxito (True/False) de cada tupla, en el mismo orden
+    """
+    results = execute_concurrent_with_args(session, statement, args_list,
+                                           concurrency=CONCURRENCY, raise_on_first_error=False)
+    ok = [success for success, _ in results]
+    errors = [result for success, result in results if not success]
+    if errors:
+        print(f"    ✗ {len(errors)} inserciones fallidas (p.ej. {errors[0]})")
+    return ok
+
+
+def insert_batched(session, statement, args_list, partition_key):
+    """
+    Agrupar las filas por partición en BatchStatement UNLOGGED de hasta BATCH_SIZE filas
+    y ejecutar los batches concurrentemente: un mensaje por grupo en lugar de uno por fila
+    """
+    batches = []
+    sizes = []
+    for _, group in groupby(sorted(args_list, key=partition_key), key=partition_key):
+        group = list(group)
+        for start in range(0, len(group), BATCH_SIZE):
+            chunk = group[start:start + BATCH_SIZE]
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for args in chunk:
+                batch.add(statement, args)
+            batches.append((batch, None))
+            sizes.append(len(chunk))
+
+    results = execute_concurrent(session, batches, concurrency=CONCURRENCY, raise_on_first_error=False)
+    failed = [(size, result) for size, (success, result) in zip(sizes, results) if not success]
+    if failed:
+        print(f"    ✗ {len(failed)} batches fallidos (p.ej. {failed[0][1]})")
+    return len(args_list) - sum(size for size, _ in failed)
+
+
 def generate_synthetic_data(session, num_events=500, num_sessions=100, num_requests=1000):
     """Generar datos sintéticos para todas las tablas"""
     
@@ -146,34 +196,42 @@ def generate_synthetic_data(session, num_events=500, num_sessions=100, num_reque
         VALUES (?, ?, ?, ?, ?)
     """)
     
-    # Diccionario para contar eventos por sesión
-    session_event_counts = {f"session_{i+1}": 0 for i in range(num_sessions)}
+    bump_event_count = session.prepare("""
+        UPDATE events_count_by_type SET cnt = cnt + ? WHERE event_type = ?
+    """)
     
     base_date = datetime.now()
+    # Los instantes se calculan como desplazamientos en segundos sobre base_ts, sin timedelta
+    base_ts = base_date.timestamp()
+
+    # Todas las variables aleatorias de cada tabla se sortean de una vez con NumPy
+    rng = np.random.default_rng()
     
 
     # 1. GENERAR EVENTOS
 
     print(f"\nGenerando {num_events} eventos:")
-    for i in range(1, num_events + 1):
-        random_days = random.randint(0, 7)
-        random_hours = random.randint(0, 23)
-        random_minutes = random.randint(0, 59)
-        random_seconds = random.randint(0, 59)
-        
-        event_time = base_date - timedelta(
-            days=random_days,
-            hours=random_hours,
-            minutes=random_minutes,
-            seconds=random_seconds
-        )
+    days = rng.integers(0, 8, num_events)
+    hours = rng.integers(0, 24, num_events)
+    minutes = rng.integers(0, 60, num_events)
+    seconds = rng.integers(0, 60, num_events)
+    event_type_idx = rng.integers(0, len(EVENT_TYPES), num_events)
+    product_ids = rng.choice(PRODUCT_IDS, num_events)
+    session_nums = rng.integers(1, num_sessions + 1, num_events)
+
+    event_ts = base_ts - (days * 86400 + hours * 3600 + minutes * 60 + seconds)
+
+    events_args = []
+    rows = zip(event_ts.tolist(), event_type_idx.tolist(), product_ids.tolist(), session_nums.tolist())
+    for i, (ts, type_idx, pid, session_num) in enumerate(rows, start=1):
+        event_time = datetime.fromtimestamp(ts)
         event_date = event_time.date()
         event_hour = event_time.hour
-        event_type = random.choice(EVENT_TYPES)
-        session_id = f"session_{random.randint(1, num_sessions)}"
-        product_id = random.choice([p['id'] for p in PRODUCTS]) if event_type != 'page_view' else None
+        event_type = EVENT_TYPES[type_idx]
+        session_id = f"session_{session_num}"
+        product_id = pid if event_type != 'page_view' else None
         
-        session.execute(insert_event, (
+        events_args.append((
             event_date, 
             event_hour,
             event_time, 
@@ -182,48 +240,68 @@ def generate_synthetic_data(session, num_events=500, num_sessions=100, num_reque
             product_id
         ))
         
-        session_event_counts[session_id] += 1
-        
-        if i % 100 == 0:
-            print(f"    Insertados {i}/{num_events} eventos")
+        if VERBOSE and i % 100 == 0:
+            print(f"    Generados {i}/{num_events} eventos")
     
-    print(f"    {num_events} eventos insertados")
+    # Filas con la misma clave primaria se sobrescriben en Cassandra: se conserva solo la última
+    # para que el contador por tipo coincida con lo que queda en events_by_day
+    unique_events = {args[:3]: (args, type_idx) for args, type_idx in zip(events_args, event_type_idx.tolist())}
+    events_args = [args for args, _ in unique_events.values()]
+    events_type_idx = np.fromiter((type_idx for _, type_idx in unique_events.values()),
+                                  dtype=np.int64, count=len(unique_events))
+
+    events_ok = np.array(insert_concurrent(session, insert_event, events_args), dtype=bool)
+    print(f"    {int(events_ok.sum())} eventos insertados")
+
+    # Eventos por sesión contados de una vez sobre el array de sesiones sorteadas
+    session_counts = np.bincount(session_nums, minlength=num_sessions + 1).tolist()
+    session_event_counts = {f"session_{i}": session_counts[i] for i in range(1, num_sessions + 1)}
+
+    # Un incremento por tipo con el total del lote, no uno por evento (solo inserciones correctas)
+    type_counts = np.bincount(events_type_idx[events_ok], minlength=len(EVENT_TYPES)).tolist()
+    counts_args = [(n, event_type) for event_type, n in zip(EVENT_TYPES, type_counts) if n]
+    insert_concurrent(session, bump_event_count, counts_args)
     
 
     # 2. GENERAR PRODUCTOS
 
     print(f"\nGenerando productos con vistas")
-    for product in PRODUCTS:
-        views = random.randint(50, 500)
-        session.execute(insert_product, (
-            product['category'],
-            product['id'],
-            product['name'],
-            views
-        ))
+    views = rng.integers(50, 501, len(PRODUCTS)).tolist()
+    products_args = [
+        (category, product_id, name, product_views)
+        for (category, product_id, name), product_views in zip(PRODUCTS, views)
+    ]
+    inserted = insert_batched(session, insert_product, products_args,
+                              partition_key=lambda row: row[0])
     
-    print(f"    {len(PRODUCTS)} productos insertados")
+    print(f"    {inserted} productos insertados")
     
 
     # 3. GENERAR SESIONES
 
     print(f"\nGenerando {num_sessions} sesiones:")
-    for session_id, total_events in session_event_counts.items():
-        start_time = base_date - timedelta(
-            days=random.randint(0, 7),
-            hours=random.randint(0, 23),
-            minutes=random.randint(0, 59)
-        )
-        end_time = start_time + timedelta(minutes=random.randint(1, 120))
+    session_days = rng.integers(0, 8, num_sessions)
+    session_hours = rng.integers(0, 24, num_sessions)
+    session_minutes = rng.integers(0, 60, num_sessions)
+    session_durations = rng.integers(1, 121, num_sessions)
+    start_ts = base_ts - (session_days * 86400 + session_hours * 3600 + session_minutes * 60)
+    end_ts = start_ts + session_durations * 60
+
+    sessions_args = []
+    rows = zip(session_event_counts.items(), start_ts.tolist(), end_ts.tolist())
+    for (session_id, total_events), s_start, s_end in rows:
+        start_time = datetime.fromtimestamp(s_start)
+        end_time = datetime.fromtimestamp(s_end)
         
-        session.execute(insert_session, (
+        sessions_args.append((
             session_id, 
             start_time, 
             end_time, 
             total_events
         ))
     
-    print(f"    {num_sessions} sesiones insertadas")
+    inserted = sum(insert_concurrent(session, insert_session, sessions_args))
+    print(f"    {inserted} sesiones insertadas")
     
 
     # 4. PETICIONES POR SEGUNDO
@@ -233,22 +311,31 @@ def generate_synthetic_data(session, num_events=500, num_sessions=100, num_reque
     # Usar diccionario para acumular peticiones del mismo segundo
     request_map = {}
     
-    for _ in range(num_requests):
-        random_days = random.randint(0, 7)
-        date_time = base_date - timedelta(days=random_days)
-        date = date_time.date()
-        hour = random.randint(0, 23)
-        minute = random.randint(0, 59)
-        second = random.randint(0, 59)
+    request_days = rng.integers(0, 8, num_requests).tolist()
+    request_hours = rng.integers(0, 24, num_requests).tolist()
+    request_minutes = rng.integers(0, 60, num_requests).tolist()
+    request_seconds = rng.integers(0, 60, num_requests).tolist()
+    request_counts = rng.integers(1, 21, num_requests).tolist()
+
+    # Solo hay 8 fechas posibles: se calculan una vez
+    dates = [datetime.fromtimestamp(base_ts - d * 86400).date() for d in range(8)]
+
+    rows = zip(request_days, request_hours, request_minutes, request_seconds, request_counts)
+    for random_days, hour, minute, second, count in rows:
+        date = dates[random_days]
         
         key = (date, hour, minute, second)
-        request_map[key] = request_map.get(key, 0) + random.randint(1, 20)
+        request_map[key] = request_map.get(key, 0) + count
     
-    # Insertar peticiones acumuladas
-    for (date, hour, minute, second), count in request_map.items():
-        session.execute(insert_request, (date, hour, minute, second, count))
+    # Insertar peticiones acumuladas, un batch por partición (date, hour)
+    requests_args = [
+        (date, hour, minute, second, count)
+        for (date, hour, minute, second), count in request_map.items()
+    ]
+    inserted = insert_batched(session, insert_request, requests_args,
+                              partition_key=lambda row: (row[0], row[1]))
     
-    print(f"    {len(request_map)} registros únicos de peticiones insertados")
+    print(f"    {inserted} registros únicos de peticiones insertados")
     
     print(f"\n{'='*70}")
     print("Datos generados")
@@ -5,32 +5,122 @@ Aplicación web Flask para TechStore
 """
 
 from flask import Flask, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 import redis as rd
 import time
 import os
-import json
+import msgpack
+import orjson
+import hashlib
+import threading
+import atexit
+from cachetools import TTLCache
 from datetime import datetime
 import random
 
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify con orjson: serializa directamente a bytes, sin pasar por json.dumps ni ordenar claves"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 REDIS_LOCAL_HOST = os.getenv('REDIS_LOCAL_HOST', 'redis-master')
 REDIS_LOCAL_PORT = int(os.getenv('REDIS_LOCAL_PORT', 6379))
 REDIS_LOCAL_PASSWORD = os.getenv('REDIS_LOCAL_PASSWORD', None)
+# Socket unix opcional (Redis en la misma máquina); si no se define se usa TCP
+REDIS_LOCAL_SOCKET = os.getenv('REDIS_LOCAL_SOCKET', None)
+# Tamaño del pool por worker: con gevent debe cubrir las peticiones concurrentes habituales
+# (--worker-connections); si se agota, las peticiones esperan hasta REDIS_POOL_TIMEOUT segundos
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 128))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+# Latencia simulada de la BD relacional (ms); 0 la desactiva para medir solo la caché
+SIMULATED_DB_LATENCY_MS = float(os.getenv('SIM_DB_MS', 1000))
+# Caché L1 en memoria del proceso delante de Redis (L2). TTL corto: una invalidación
+# solo limpia la L1 del worker que la recibe, los demás caducan en L1_TTL segundos
+L1_TTL = float(os.getenv('L1_TTL', 5))
+# Cerrojo anti-estampida: solo un worker consulta la BD por clave; el resto espera a la caché.
+# El TTL (segundos) cubre holgadamente la latencia simulada para que no caduque durante la recarga
+# y libera el cerrojo si el worker que recarga cae
+STAMPEDE_LOCK_TTL = max(5, 2 * SIMULATED_DB_LATENCY_MS / 1000)
+STAMPEDE_POLL_INTERVAL = 0.05
+STAMPEDE_MAX_POLLS = int(STAMPEDE_LOCK_TTL / STAMPEDE_POLL_INTERVAL)
+# Cada cuántos segundos envía cada worker a Redis los aciertos L1 acumulados
+STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', 5))
 
 try:
-    redis_cache = rd.Redis(
-        host=REDIS_LOCAL_HOST,
-        port=REDIS_LOCAL_PORT,
-        password=REDIS_LOCAL_PASSWORD,
-        decode_responses=True
-    )
+    # Un único pool acotado compartido por todas las peticiones del worker
+    if REDIS_LOCAL_SOCKET:
+        pool = rd.BlockingConnectionPool(
+            connection_class=rd.UnixDomainSocketConnection,
+            path=REDIS_LOCAL_SOCKET,
+            password=REDIS_LOCAL_PASSWORD,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            # Comprobar conexiones que llevan tiempo ociosas antes de reutilizarlas
+            health_check_interval=30,
+            client_name='cachesimulator',
+            # Valores en bytes: la caché guarda los productos en MessagePack
+            decode_responses=False
+        )
+    else:
+        pool = rd.BlockingConnectionPool(
+            host=REDIS_LOCAL_HOST,
+            port=REDIS_LOCAL_PORT,
+            password=REDIS_LOCAL_PASSWORD,
+            socket_keepalive=True,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            # Comprobar conexiones que llevan tiempo ociosas antes de reutilizarlas
+            health_check_interval=30,
+            client_name='cachesimulator',
+            # Valores en bytes: la caché guarda los productos en MessagePack
+            decode_responses=False
+        )
+    redis_cache = rd.Redis(connection_pool=pool)
     redis_cache.ping()
-    print(f"✓ Redis Cache conectado ({REDIS_LOCAL_HOST}:{REDIS_LOCAL_PORT})")
+    print(f"✓ Redis Cache conectado ({REDIS_LOCAL_SOCKET or f'{REDIS_LOCAL_HOST}:{REDIS_LOCAL_PORT}'})")
 except Exception as e:
     print(f"✗ Error conectando a Redis Cache: {e}")
     redis_cache = None
 
+# Contadores de aciertos/fallos como campos de un único hash
+STATS_KEY = "cache:stats"
+
+# GET + contador de aciertos en el servidor: un solo viaje a Redis por acierto.
+# ARGV[1] son aciertos L1 pendientes que se suman en el mismo viaje
+GET_AND_COUNT_HIT_LUA = """
+local value = redis.call('GET', KEYS[1])
+local hits = tonumber(ARGV[1])
+if value then
+    hits = hits + 1
+end
+if hits > 0 then
+    redis.call('HINCRBY', KEYS[2], 'hits', hits)
+end
+return value
+"""
+get_and_count_hit = redis_cache.register_script(GET_AND_COUNT_HIT_LUA) if redis_cache else None
+
+# Soltar el cerrojo solo si sigue siendo nuestro: si caducó y lo tomó otro worker no se toca
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+release_lock = redis_cache.register_script(RELEASE_LOCK_LUA) if redis_cache else None
+
 PRODUCTS = [
     {"id": 1, "name": "Smartphone Pro X", "price": 899.0, "category": "Smartphones"},
     {"id": 2, "name": "Laptop Ultra 15\"", "price": 1299.0, "category": "Laptops"},
@@ -42,17 +132,82 @@ PRODUCTS = [
     {"id": 8, "name": "Ratón Gaming Pro", "price": 79.0, "category": "Periféricos"}
 ]
 
+# Catálogo completo bajo una sola clave: el listado cacheado es un único GET
+ALL_PRODUCTS_KEY = "cache:products:all"
+
+# PRODUCTS es constante: claves y MessagePack se calculan una vez al arrancar
+_PRODUCT_KEY_BY_ID = {p["id"]: f"cache:product:{p['id']}" for p in PRODUCTS}
+_PRODUCT_LOCK_KEY_BY_ID = {pid: f"lock:{key}" for pid, key in _PRODUCT_KEY_BY_ID.items()}
+_PRODUCT_PACKED_BY_ID = {p["id"]: msgpack.packb(p, use_bin_type=True) for p in PRODUCTS}
+_ALL_PRODUCTS_PACKED = msgpack.packb(PRODUCTS, use_bin_type=True)
+
+# Índices de la "BD" simulada: búsqueda por id y por categoría en O(1)
+_BY_ID = {p["id"]: p for p in PRODUCTS}
+_BY_CATEGORY = {}
+for _p in PRODUCTS:
+    _BY_CATEGORY.setdefault(_p["category"], []).append(_p)
+
+_l1_cache = TTLCache(maxsize=1024, ttl=L1_TTL)
+_l1_lock = threading.Lock()
+# Aciertos L1 aún no enviados a Redis: se acumulan en memoria para que un acierto L1
+# no espere a Redis. Viajan con el siguiente comando de este worker, cada
+# STATS_FLUSH_INTERVAL segundos y al salir el worker. Las estadísticas son aproximadas:
+# /cache/stats puede ir hasta STATS_FLUSH_INTERVAL por detrás de otros workers y un
+# worker que muere sin salida ordenada pierde sus aciertos pendientes
+_pending_l1_hits = 0
+
+
+def take_pending_l1_hits():
+    """Devuelve los aciertos L1 pendientes y pone el contador a 0"""
+    global _pending_l1_hits
+    with _l1_lock:
+        pending, _pending_l1_hits = _pending_l1_hits, 0
+    return pending
+
+
+def restore_pending_l1_hits(pending):
+    """Devolver al contador unos aciertos L1 que no llegaron a Redis, para el siguiente intento"""
+    global _pending_l1_hits
+    if pending:
+        with _l1_lock:
+            _pending_l1_hits += pending
+
+
+def flush_pending_l1_hits():
+    """Enviar a Redis los aciertos L1 pendientes; si Redis falla se conservan para el siguiente intento"""
+    pending = take_pending_l1_hits()
+    if not pending or not redis_cache:
+        return
+    try:
+        redis_cache.hincrby(STATS_KEY, 'hits', pending)
+    except rd.RedisError:
+        restore_pending_l1_hits(pending)
+
+
+def _l1_hits_flusher():
+    while True:
+        time.sleep(STATS_FLUSH_INTERVAL)
+        flush_pending_l1_hits()
+
+
+if redis_cache:
+    # Un hilo por worker (gunicorn importa la app en cada worker); con gevent es un greenlet
+    threading.Thread(target=_l1_hits_flusher, daemon=True).start()
+    atexit.register(flush_pending_l1_hits)
+
 
 def get_from_relational_db_simulated(query_type, **kwargs):
-    time.sleep(1)
+    # Con los workers gevent de gunicorn time.sleep cede el control y no bloquea el worker
+    if SIMULATED_DB_LATENCY_MS:
+        time.sleep(SIMULATED_DB_LATENCY_MS / 1000)
     if query_type == "all_products":
         return PRODUCTS
     elif query_type == "product_by_id":
         product_id = kwargs.get("product_id")
-        return next((p for p in PRODUCTS if p["id"] == product_id), None)
+        return _BY_ID.get(product_id)
     elif query_type == "products_by_category":
         category = kwargs.get("category")
-        return [p for p in PRODUCTS if p["category"] == category]
+        return _BY_CATEGORY.get(category, [])
     return None
 
 @app.route('/')
@@ -67,8 +222,12 @@ def get_products():
         lat = (time.time() - start_time) * 1000
 
         if redis_cache:
-            for p in productos:
-                redis_cache.set(f"cache:product:{p['id']}", json.dumps(p), ex=60)
+            # Todas las escrituras en un único viaje a Redis
+            pipe = redis_cache.pipeline(transaction=False)
+            for pid, packed in _PRODUCT_PACKED_BY_ID.items():
+                pipe.set(_PRODUCT_KEY_BY_ID[pid], packed, ex=60)
+            pipe.set(ALL_PRODUCTS_KEY, _ALL_PRODUCTS_PACKED, ex=60)
+            pipe.execute()
 
         return jsonify({
             'source': 'database',
@@ -86,10 +245,11 @@ def get_products_cached():
         start_time = time.time()
 
         if redis_cache:
-            keys = redis_cache.keys("cache:product:*")
+            # GETEX lee el catálogo y recarga su TTL en un solo comando, sin reenviar el valor
+            data = redis_cache.getex(ALL_PRODUCTS_KEY, ex=60)
 
             # Si NO hay productos cacheados → devolver lista vacía
-            if not keys:
+            if not data:
                 return jsonify({
                     'source': 'cache',
                     'count': 0,
@@ -97,22 +257,23 @@ def get_products_cached():
                     'latency_ms': (time.time() - start_time) * 1000
                 })
 
-            productos = []
-            for k in keys:
-                data = redis_cache.get(k)
-                if data:
-                    p = json.loads(data)
-                    productos.append(p)
-
-                    # recargar TTL
-                    redis_cache.set(f"cache:product:{p['id']}", json.dumps(p), ex=60)
-
-            return jsonify({
-                'source': 'cache',
-                'count': len(productos),
-                'data': productos,
-                'latency_ms': (time.time() - start_time) * 1000
-            })
+            # ETag a partir de los bytes cacheados: si el cliente ya tiene esta versión
+            # del catálogo se responde 304 sin decodificar ni serializar nada
+            etag = hashlib.blake2b(data, digest_size=8).hexdigest()
+            if etag in request.if_none_match:
+                response = app.response_class(status=304)
+            else:
+                productos = msgpack.unpackb(data, raw=False)
+                response = jsonify({
+                    'source': 'cache',
+                    'count': len(productos),
+                    'data': productos,
+                    'latency_ms': (time.time() - start_time) * 1000
+                })
+            response.set_etag(etag)
+            # Revalidar siempre: una invalidación debe verse en la siguiente petición
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
 
         # Cache no disponible
         return jsonify({'error': 'Cache not available'}), 503
@@ -122,27 +283,75 @@ def get_products_cached():
 
 @app.route('/products/<int:product_id>', methods=['GET'])
 def get_product(product_id):
+    global _pending_l1_hits
+    got_lock = False
+    lock_key = None
+    lock_token = os.urandom(8)  # identifica a esta petición como dueña del cerrojo
     try:
-        cache_key = f"cache:product:{product_id}"
+        # Claves precalculadas para el catálogo conocido; solo se formatean ids desconocidos
+        cache_key = _PRODUCT_KEY_BY_ID.get(product_id) or f"cache:product:{product_id}"
         start_time = time.time()
 
+        with _l1_lock:
+            product = _l1_cache.get(cache_key)
+            if product is not None:
+                _pending_l1_hits += 1
+        if product is not None:
+            return jsonify({
+                'source': 'memory',
+                'data': product,
+                'latency_ms': (time.time() - start_time) * 1000
+            })
+
         if redis_cache:
-            cached = redis_cache.get(cache_key)
+            lock_key = _PRODUCT_LOCK_KEY_BY_ID.get(product_id) or f"lock:{cache_key}"
+            pending = take_pending_l1_hits()
+            try:
+                cached = get_and_count_hit(keys=[cache_key, STATS_KEY], args=[pending])
+            except rd.RedisError:
+                restore_pending_l1_hits(pending)
+                raise
+            polls = 0
+            # Solo consulta la BD quien tiene el cerrojo. Mientras otro worker lo tenga se espera
+            # a la caché; si lo suelta sin rellenarla (404, error) el SET NX siguiente lo obtiene
+            while not cached:
+                got_lock = redis_cache.set(lock_key, lock_token, nx=True, px=int(STAMPEDE_LOCK_TTL * 1000))
+                if got_lock or polls == STAMPEDE_MAX_POLLS:
+                    break
+                time.sleep(STAMPEDE_POLL_INTERVAL)
+                polls += 1
+                cached = get_and_count_hit(keys=[cache_key, STATS_KEY], args=[0])
             if cached:
-                return jsonify({
+                product = msgpack.unpackb(cached, raw=False)
+                with _l1_lock:
+                    _l1_cache[cache_key] = product
+                response = jsonify({
                     'source': 'cache',
-                    'data': json.loads(cached),
+                    'data': product,
                     'latency_ms': (time.time() - start_time) * 1000
                 })
+                return response
 
         product = get_from_relational_db_simulated("product_by_id", product_id=product_id)
         db_latency = (time.time() - start_time) * 1000
 
         if not product:
+            if redis_cache:
+                pipe = redis_cache.pipeline(transaction=False)
+                pipe.hincrby(STATS_KEY, 'misses', 1)
+                if got_lock:
+                    release_lock(keys=[lock_key], args=[lock_token], client=pipe)
+                pipe.execute()
             return jsonify({'error': 'Product not found'}), 404
 
         if redis_cache:
-            redis_cache.set(cache_key, json.dumps(product), ex=60)
+            # El fallo se contabiliza en el mismo viaje que rellena la caché y suelta el cerrojo
+            pipe = redis_cache.pipeline(transaction=False)
+            pipe.set(cache_key, _PRODUCT_PACKED_BY_ID[product["id"]], ex=60)
+            pipe.hincrby(STATS_KEY, 'misses', 1)
+            if got_lock:
+                release_lock(keys=[lock_key], args=[lock_token], client=pipe)
+            pipe.execute()
 
         return jsonify({
             'source': 'database',
@@ -151,6 +360,12 @@ def get_product(product_id):
         })
 
     except Exception as e:
+        # Soltar el cerrojo para que los que esperan no agoten el TTL
+        if got_lock:
+            try:
+                release_lock(keys=[lock_key], args=[lock_token])
+            except rd.RedisError:
+                pass
         return jsonify({'error': str(e)}), 500
 
 @app.route('/cache/stats', methods=['GET'])
@@ -159,8 +374,18 @@ def cache_stats():
         if not redis_cache:
             return jsonify({'error': 'Cache not available'}), 503
 
-        hits = int(redis_cache.get('cache:stats:hits') or 0)
-        misses = int(redis_cache.get('cache:stats:misses') or 0)
+        pipe = redis_cache.pipeline(transaction=False)
+        pending = take_pending_l1_hits()
+        if pending:
+            pipe.hincrby(STATS_KEY, 'hits', pending)
+        pipe.hmget(STATS_KEY, 'hits', 'misses')
+        try:
+            hits, misses = pipe.execute()[-1]
+        except rd.RedisError:
+            restore_pending_l1_hits(pending)
+            raise
+        hits = int(hits or 0)
+        misses = int(misses or 0)
         total = hits + misses
         hit_rate = (hits / total * 100) if total > 0 else 0
 
@@ -181,13 +406,38 @@ def invalidate_cache():
         if not redis_cache:
             return jsonify({'error': 'Cache not available'}), 503
 
-        data = request.get_json()
+        # Cuerpo ausente o mal formado -> 400 en lugar de 500; sin guardar el JSON en la petición
+        data = request.get_json(silent=True, cache=False)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'No data provided'}), 400
         target = data.get('target', 'all')
 
         if target == 'product':
-            product_id = data.get('product_id')
-            redis_cache.delete(f'cache:product:{product_id}')
+            # Llega desde JSON: puede venir como cadena ("3") o no ser un id válido
+            try:
+                product_id = int(data.get('product_id'))
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid product_id'}), 400
+            # El catálogo completo también contiene el producto
+            cache_key = _PRODUCT_KEY_BY_ID.get(product_id) or f'cache:product:{product_id}'
+            redis_cache.delete(cache_key, ALL_PRODUCTS_KEY)
+            with _l1_lock:
+                _l1_cache.pop(cache_key, None)
             message = f'Product {product_id} invalidated'
+        elif target == 'all':
+            # SCAN por cursor en lugar de KEYS: no bloquea Redis aunque haya muchas claves
+            keys = [ALL_PRODUCTS_KEY]
+            deleted = 0
+            for key in redis_cache.scan_iter(match='cache:product:*', count=1000):
+                keys.append(key)
+                if len(keys) >= 500:
+                    deleted += redis_cache.delete(*keys)
+                    keys = []
+            if keys:
+                deleted += redis_cache.delete(*keys)
+            with _l1_lock:
+                _l1_cache.clear()
+            message = f'{deleted} cache keys invalidated'
         else:
             return jsonify({'error': 'Invalid target'}), 400
 
@@ -202,7 +452,11 @@ def invalidate_cache_get(product_id):
         if not redis_cache:
             return jsonify({'error': 'Cache not available'}), 503
 
-        redis_cache.delete(f'cache:product:{product_id}')
+        # El catálogo completo también contiene el producto
+        cache_key = _PRODUCT_KEY_BY_ID.get(product_id) or f'cache:product:{product_id}'
+        redis_cache.delete(cache_key, ALL_PRODUCTS_KEY)
+        with _l1_lock:
+            _l1_cache.pop(cache_key, None)
 
         return jsonify({'status': 'success', 'message': f'Product {product_id} invalidated'})
     except Exception as e:
@@ -211,4 +465,6 @@ def invalidate_cache_get(product_id):
 
 if __name__ == '__main__':
     print("TechStore iniciada")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Solo para desarrollo local: en Docker se sirve con gunicorn (ver Dockerfile).
+    # El depurador y el recargador se activan explícitamente con FLASK_DEBUG=1
+    app.run(debug=os.getenv('FLASK_DEBUG', '0') == '1', host='0.0.0.0', port=5000)
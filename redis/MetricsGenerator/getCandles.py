@@ -1,7 +1,8 @@
 import dash
-from dash import dcc, html
-from dash.dependencies import Output, Input
+from dash import dcc, html, Patch
+from dash.dependencies import Output, Input, State
 import plotly.graph_objs as go
+import numpy as np
 import redis as rd
 import time
 import os
@@ -37,7 +38,7 @@ def connectDB(host: str = None, port: int = None, db: int = 0, username: str = N
             db=db,
             username=username,
             password=password,
-            decode_responses=True,
+            decode_responses=False,  # Solo se leen enteros: int() acepta bytes sin decodificar
             socket_connect_timeout=10
         )
         r.ping()
@@ -61,11 +62,15 @@ if r is None:
 
 interval = 5  # segundos por vela
 max_candles = 20  # cuántas velas mostrar en pantalla
+TIMELINE_KEY = "requests:timeline"  # ZSET escrito por SamplesGenerator (score = timestamp)
+verbose = os.getenv("VERBOSE", "0") == "1"  # volcar las velas calculadas en cada refresco
 
 app = dash.Dash(__name__)
 app.layout = html.Div([
     html.H1("Número de Requests en tiempo real", style={'textAlign': 'center'}),
     dcc.Graph(id='candlestick-graph'),
+    # Fin (timestamp) de la última vela dibujada: permite enviar solo las velas nuevas
+    dcc.Store(id='last-candle-ts', data=None),
     dcc.Interval(
         id='interval-component',
         interval=5000,  # actualización cada 5 segundos
@@ -73,73 +78,89 @@ app.layout = html.Div([
     )
 ])
 
-def get_candles():
+def get_aligned_now():
     """
-    Lee los últimos max_candles*interval segundos de Redis
-    y calcula velas tipo OHLC con ventanas no solapadas
+    Devuelve el instante actual del servidor Redis alineado a intervalos de 5 segundos.
+    Esto asegura que las ventanas siempre terminen en múltiplos de 5
     """
     ts_now = r.time()[0]
+    return (ts_now // interval) * interval
+
+
+def get_candles(aligned_now=None, n_candles=max_candles):
+    """
+    Lee los últimos n_candles*interval segundos de Redis (hasta aligned_now)
+    y calcula velas tipo OHLC con ventanas no solapadas
+    """
+    if aligned_now is None:
+        aligned_now = get_aligned_now()
+    start_ts = aligned_now - (n_candles * interval)
     
-    # Calcular el inicio alineado a intervalos de 5 segundos
-    # Esto asegura que las ventanas siempre terminen en múltiplos de 5
-    aligned_now = (ts_now // interval) * interval
-    start_ts = aligned_now - (max_candles * interval)
-    
-    # Leer todos los valores del rango de tiempo
-    all_counts = []
-    for ts in range(start_ts, aligned_now + interval):
-        val = r.get(f"requests:{ts}")
-        count = int(val) if val is not None else 0
-        all_counts.append((ts, count))
+    # Leer todo el rango de tiempo con una única consulta por score sobre el ZSET
+    members = r.zrangebyscore(TIMELINE_KEY, start_ts, aligned_now - 1)
+    counts = np.zeros(n_candles * interval, dtype=np.int64)  # segundos sin muestra cuentan como 0
+    for member in members:
+        ts, n_requests = member.split(b":")
+        counts[int(ts) - start_ts] = int(n_requests)
     
-    # Agrupar en velas de `interval` segundos
-    candles = []
+    # Una fila por vela: OHLC calculado por filas con NumPy
+    windows = counts.reshape(n_candles, interval)
+    opens = windows[:, 0]    # primer valor en la ventana
+    closes = windows[:, -1]  # último valor en la ventana
+    highs = windows.max(axis=1)  # máximo
+    lows = windows.min(axis=1)   # mínimo
     
-    for i in range(max_candles):
-        # Calcular el rango de tiempo para esta vela
-        candle_start = start_ts + (i * interval)
-        candle_end = candle_start + interval
-        
-        # Filtrar valores que pertenecen a esta vela [start, end)
-        group = [(ts, val) for ts, val in all_counts 
-                 if candle_start <= ts < candle_end]
-        
-        if not group:
-            # Si no hay datos, crear vela con valores 0
-            candles.append({
-                'time': datetime.fromtimestamp(candle_end, tz=timezone.utc),
-                'open': 0,
-                'high': 0,
-                'low': 0,
-                'close': 0
-            })
-            continue
-        
-        # Calcular OHLC
-        o = group[0][1]   # primer valor en la ventana
-        c = group[-1][1]  # último valor en la ventana
-        h = max(v for _, v in group)  # máximo
-        l = min(v for _, v in group)  # mínimo
-        
-        candles.append({
-            'time': datetime.fromtimestamp(candle_end, tz=timezone.utc),
+    candles = [
+        {
+            'time': datetime.fromtimestamp(start_ts + (i + 1) * interval, tz=timezone.utc),
             'open': o,
             'high': h,
             'low': l,
             'close': c
-        })
-    print(candles)
+        }
+        for i, (o, h, l, c) in enumerate(zip(opens.tolist(), highs.tolist(), lows.tolist(), closes.tolist()))
+    ]
+    if verbose:
+        print(candles)
     return candles
 
 @app.callback(
     Output('candlestick-graph', 'figure'),
-    Input('interval-component', 'n_intervals')
+    Output('last-candle-ts', 'data'),
+    Input('interval-component', 'n_intervals'),
+    State('last-candle-ts', 'data')
 )
-def update_graph(n):
-    candles = get_candles()
+def update_graph(n, last_ts):
+    aligned_now = get_aligned_now()
+    
+    if last_ts is not None and n > 0:
+        new_candles = (aligned_now - last_ts) // interval
+        if new_candles == 0:
+            # Ninguna vela cerrada desde el último refresco: no se envía nada al navegador
+            return dash.no_update, dash.no_update
+        if 0 < new_candles < max_candles:
+            # Solo se leen y envían las velas nuevas; las más antiguas se descartan
+            # para mantener la ventana deslizante de max_candles.
+            # La última vela ya dibujada se vuelve a leer y se sobrescribe: una muestra
+            # que llegó a Redis tras el refresco anterior no se pierde
+            patch = Patch()
+            trace = patch['data'][0]
+            refreshed, *nuevas = get_candles(aligned_now, new_candles + 1)
+            for field in ('open', 'high', 'low', 'close'):
+                trace[field][max_candles - 1] = refreshed[field]
+            for c in nuevas:
+                for field in ('open', 'high', 'low', 'close'):
+                    trace[field].append(c[field])
+                    del trace[field][0]
+                trace['x'].append(c['time'])
+                del trace['x'][0]
+            return patch, aligned_now
+    
+    # Primera carga (o desfase mayor que la ventana): figura completa
+    candles = get_candles(aligned_now)
     
     if not candles:
-        return go.Figure()
+        return go.Figure(), aligned_now
     
     fig = go.Figure(go.Candlestick(
         x=[c['time'] for c in candles],
@@ -168,7 +189,8 @@ def update_graph(n):
         dtick=interval * 1000  # milliseconds
     )
     
-    return fig
+    return fig, aligned_now
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=8050)
+    # Sin depurador ni recargador salvo que se pida con DASH_DEBUG=1
+    app.run(debug=os.getenv('DASH_DEBUG', '0') == '1', host='0.0.0.0', port=8050)
@@ -2,10 +2,20 @@ import time
 import os
 from math import sin
 
-from numpy.random import normal
+import numpy as np
 import redis as rd
 
 
+# Ruido N(0,1) pregenerado en bloque: evita una llamada a NumPy (y un array de 1 elemento) por muestra
+NOISE_BUFFER_SIZE = 4096
+_rng = np.random.default_rng()
+_noise = _rng.standard_normal(NOISE_BUFFER_SIZE)
+_noise_idx = 0
+
+# Serie de peticiones por segundo: ZSET con score = timestamp y miembro "timestamp:peticiones"
+TIMELINE_KEY = "requests:timeline"
+TIMELINE_RETENTION = 120  # segundos que se conservan en la serie
+
 
 def connectDB(host: str = None, port: int = None, db: int = 0, username: str = None, password: str = None) -> rd.Redis:
     """
@@ -31,15 +41,31 @@ def connectDB(host: str = None, port: int = None, db: int = 0, username: str = N
 
     print(f"GETCANDLES: {host}:{port} | {username}:{password}")
     try:
-        r = rd.Redis(
-            host=host,
-            port=port,
-            db=db,
-            username=username,
-            password=password,
-            decode_responses=False,
-            socket_connect_timeout=10
-        )
+        socket_path = os.getenv('REDIS_SOCKET_PATH', '/var/run/redis/redis.sock')
+        if host in ("localhost", "127.0.0.1") and os.path.exists(socket_path):
+            # Redis en la misma máquina: socket unix, sin pasar por la pila TCP/IP
+            pool = rd.ConnectionPool(
+                connection_class=rd.UnixDomainSocketConnection,
+                path=socket_path,
+                db=db,
+                username=username,
+                password=password,
+                decode_responses=False,
+                socket_connect_timeout=10
+            )
+            r = rd.Redis(connection_pool=pool)
+        else:
+            r = rd.Redis(
+                host=host,
+                port=port,
+                db=db,
+                username=username,
+                password=password,
+                decode_responses=False,
+                socket_connect_timeout=10,
+                socket_keepalive=True,
+                health_check_interval=30
+            )
         r.ping()
         user_info = f" (usuario: {username})" if username else ""
         print(f"✓ Conectado a Redis CLOUD{user_info}: {host}:{port}")
@@ -55,9 +81,16 @@ def generateSamples(instant: int, media = 10, desv = 2, A = 5) -> int:
     El algoritmo que usa se basa en una distribución con forma A*cos(t)+N(0,𝝈²)+µ con µ = media y 𝝈²=desv
     Para valores negativos redondea a 0 y en caso de decimales redondea a la unidad inferior más cercana
     """
-    valor = max(A*sin(instant) + media + normal(media,desv,1),0)
-    return round(valor[0])
-    
+    global _noise, _noise_idx
+    if _noise_idx == NOISE_BUFFER_SIZE:
+        _noise = _rng.standard_normal(NOISE_BUFFER_SIZE)
+        _noise_idx = 0
+    ruido = media + desv * float(_noise[_noise_idx])
+    _noise_idx += 1
+
+    valor = A*sin(instant) + media + ruido
+    return round(valor) if valor > 0 else 0
+
 
 def main():
     r = connectDB()
@@ -67,22 +100,34 @@ def main():
 
     print("Iniciando simulación...")
     
+    # El reloj de pared solo se lee una vez: cada tick avanza exactamente un segundo
+    # y la espera se calcula con el reloj monótono, así no se acumula deriva
+    start_ts = int(time.time())
+    start_mono = time.monotonic()
+    tick = 0
+
     try:
         while True:
             # Tiempo actual en segundos
-            ts = int(time.time())
+            ts = start_ts + tick
             # Genera número de solicitudes para este segundo
             n_requests = generateSamples(ts)
             
             # Enviar a Redis número de solicitudes
-            key = f"requests:{ts}"
-            r.set(key, n_requests)
-            r.expire(key, 120)  # Evitar sobreexceso de registros (120 segs) -> Suficientes para leer 20 velas
+            # Una única clave ZSET con score = timestamp: el lector pide el rango entero con ZRANGEBYSCORE.
+            # El miembro lleva el timestamp para que sea único aunque se repita el número de peticiones
+            pipe = r.pipeline(transaction=False)
+            pipe.zadd(TIMELINE_KEY, {b"%d:%d" % (ts, n_requests): ts})
+            pipe.zremrangebyscore(TIMELINE_KEY, "-inf", ts - TIMELINE_RETENTION)  # Evitar sobreexceso de registros (120 segs) -> Suficientes para leer 20 velas
+            pipe.execute()
             
             print(f"[{ts}] Peticiones generadas: {n_requests}")
             
             # Esperar hasta el siguiente segundo
-            time.sleep(1)
+            tick += 1
+            delay = start_mono + tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
     except KeyboardInterrupt:
         print("Simulación detenida")
 